@@ -3,12 +3,25 @@ F5-TTS Vietnamese Text-to-Speech Application
 Main entry point for the Gradio-based web interface.
 """
 
-import spaces
 import os
-from huggingface_hub import login
-import gradio as gr
-from cached_path import cached_path
+import importlib.util
+
+# Use the Rust multi-connection downloader when installed; must be set before huggingface_hub is imported
+if importlib.util.find_spec("hf_transfer") is not None:
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+
+import spaces
+import re
+import functools
 import tempfile
+import threading
+import soundfile as sf
+import torch
+from huggingface_hub import login, hf_hub_download
+import gradio as gr
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from torch.nn.attention import SDPBackend, sdpa_kernel
 from vinorm import TTSnorm
 
 # Import internal F5-TTS inference utilities
@@ -17,8 +30,13 @@ from f5_tts.infer.utils_infer import (
     preprocess_ref_audio_text,
     load_vocoder,
     load_model,
-    infer_process,
-    save_spectrogram,
+    fuse_qkv_projections,
+    CUDAGraphVocos,
+    infer_batch_process,
+    infer_process_stream,
+    infer_multi_process,
+    spectrogram_to_image,
+    n_mel_channels,
 )
 
 # --- Configuration & Authentication ---
@@ -31,24 +49,33 @@ SAMPLES_TXT_DIR = os.path.join(SAMPLES_DIR, "txt")
 os.makedirs(SAMPLES_WAVS_DIR, exist_ok=True)
 os.makedirs(SAMPLES_TXT_DIR, exist_ok=True)
 
+# Audio file extensions listed as samples (lowercase)
+_AUDIO_EXTS = frozenset({".wav", ".mp3", ".m4a", ".flac"})
+
+# Sample list cache, keyed on the mtimes of the scanned directories
+_sample_list_cache = {}
+
 def get_sample_list():
     """Scans both samples/ and samples/wavs directory for audio files."""
-    audio_extensions = (".wav", ".mp3", ".m4a", ".flac")
-    samples = []
-    
-    # Scan root
-    if os.path.exists(SAMPLES_DIR):
-        for f in os.listdir(SAMPLES_DIR):
-            if f.lower().endswith(audio_extensions):
-                samples.append(f)
-                
-    # Scan wavs subfolder
-    if os.path.exists(SAMPLES_WAVS_DIR):
-        for f in os.listdir(SAMPLES_WAVS_DIR):
-            if f.lower().endswith(audio_extensions) and f not in samples:
-                samples.append(f)
-                
-    return ["None"] + sorted(samples)
+    scan_dirs = [d for d in (SAMPLES_DIR, SAMPLES_WAVS_DIR) if os.path.isdir(d)]
+
+    # A directory's mtime changes whenever entries are added, removed or renamed
+    cache_key = tuple((d, os.stat(d).st_mtime_ns) for d in scan_dirs)
+    if cache_key in _sample_list_cache:
+        return list(_sample_list_cache[cache_key])
+
+    # Scan root and wavs subfolder; a set drops files present in both
+    samples = set()
+    for scan_dir in scan_dirs:
+        with os.scandir(scan_dir) as entries:
+            for entry in entries:
+                if os.path.splitext(entry.name)[1].lower() in _AUDIO_EXTS:
+                    samples.add(entry.name)
+
+    sample_list = ["None"] + sorted(samples)
+    _sample_list_cache.clear()
+    _sample_list_cache[cache_key] = sample_list
+    return list(sample_list)
 
 def on_sample_change(sample_name):
     """Callback when a sample is selected from the dropdown."""
@@ -97,6 +124,10 @@ hf_token = os.getenv("HUGGINGFACEHUB_API_TOKEN")
 if hf_token:
     login(token=hf_token)
 
+# Doubled "." / "," tokens (". ." or "..") delimited by plain spaces or the string ends, or a double quote.
+# Only " " counts as a delimiter, like the str.replace chain this replaces: tabs and newlines do not
+_PUNCT_RE = re.compile(r'(?<![^ ])([.,]) ?\1(?![^ ])|"')
+
 def post_process(text):
     """
     Cleans up the normalized text by removing redundant punctuation and spaces.
@@ -106,75 +137,326 @@ def post_process(text):
     Returns:
         str: Cleaned text ready for synthesis.
     """
-    text = " " + text + " "
-    text = text.replace(" . . ", " . ")
-    text = " " + text + " "
-    text = text.replace(" .. ", " . ")
-    text = " " + text + " "
-    text = text.replace(" , , ", " , ")
-    text = " " + text + " "
-    text = text.replace(" ,, ", " , ")
-    text = " " + text + " "
-    text = text.replace('"', "")
+    # Single regex pass: collapse doubled punctuation to one mark and drop quotes.
+    # A quote leaves group 1 unmatched, which the template expands to "", so no Python callback runs per match
+    text = _PUNCT_RE.sub(r"\1", text)
     return " ".join(text.split())
 
+# vinorm shells out to a binary through fixed files in its package directory, so calls must not
+# overlap: a single worker thread serializes them while keeping them off the request thread
+_NORM_POOL = ThreadPoolExecutor(max_workers=1)
+
+def normalize_text(text):
+    """Converts numbers and special characters to spoken Vietnamese and cleans the result."""
+    return post_process(TTSnorm(text)).lower()
+
 # --- Model Loading ---
 
+# TF32 matmuls/convolutions for any FP32 work left on Ampere+ GPUs.
+# cuDNN autotuning stays off: DiT conv shapes follow each request's duration, so it would re-benchmark constantly
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.backends.cudnn.allow_tf32 = True
+
+# Explicit Hugging Face cache location (e.g. persistent storage on Spaces); None keeps the default
+HF_CACHE_DIR = os.environ.get("HF_HUB_CACHE")
+
 # Load the vocoder (Vocos is the default)
-vocoder = load_vocoder()
+# On CUDA its backbone runs in FP16 from CUDA graphs captured per mel-length bucket
+vocoder = CUDAGraphVocos(load_vocoder(hf_cache_dir=HF_CACHE_DIR))
 
 # Load the F5-TTS DiT model
-# We use cached_path to download and cache model files from Hugging Face
+# BF16 halves weight traffic like FP16 but keeps FP32's range; without it load_model picks FP16/FP32.
+# Only native BF16 counts (Ampere+): pre-Ampere GPUs such as the T4 would emulate it, and their
+# fused attention kernels take FP16 only
+model_dtype = (
+    torch.bfloat16
+    if torch.cuda.is_available() and torch.cuda.is_bf16_supported(including_emulation=False)
+    else None
+)
+
+# Download checkpoint and vocab in parallel so startup waits for the slower file, not both
+with ThreadPoolExecutor(max_workers=2) as executor:
+    ckpt_file, vocab_file = executor.map(
+        lambda filename: hf_hub_download(
+            repo_id="hynt/F5-TTS-Vietnamese-ViVoice", filename=filename, cache_dir=HF_CACHE_DIR
+        ),
+        ["model_last.pt", "config.json"],
+    )
+
 model = load_model(
     DiT,
     dict(dim=1024, depth=22, heads=16, ff_mult=2, text_dim=512, conv_layers=4),
-    ckpt_path=str(cached_path("hf://hynt/F5-TTS-Vietnamese-ViVoice/model_last.pt")),
-    vocab_file=str(cached_path("hf://hynt/F5-TTS-Vietnamese-ViVoice/config.json")),
+    ckpt_path=ckpt_file,
+    vocab_file=vocab_file,
+    dtype=model_dtype,
 )
 
+# Pack each DiT block's Q/K/V projections into one Linear: one GEMM per attention layer instead of three
+fuse_qkv_projections(model)
+
+# On ZeroGPU every @spaces.GPU call runs in a fresh worker, so compiled graphs cannot be kept warm
+ZERO_GPU = bool(os.getenv("SPACES_ZERO_GPU"))
+COMPILE_DIT = torch.cuda.is_available() and not ZERO_GPU
+
+# Quantize the Linear layers of the DiT blocks to int8 weights (weight-only), cutting their weight
+# traffic in the memory-bound denoising loop. Embeddings, the time MLP and the output projection
+# keep the model dtype. Only worth it compiled: eagerly, torchao dequantizes the whole weight on
+# every call, adding traffic instead. Must happen before compilation.
+# A torchao build that does not match torch can fail to import with other errors than ImportError;
+# like a missing torchao, it only costs the quantization.
+if COMPILE_DIT:
+    try:
+        from torchao.quantization import quantize_, Int8WeightOnlyConfig
+    except Exception as e:
+        print(f"torchao is unavailable ({e}), the DiT runs without int8 quantization.")
+    else:
+        quantize_(
+            model,
+            Int8WeightOnlyConfig(),
+            filter_fn=lambda module, fqn: isinstance(module, torch.nn.Linear)
+            and fqn.startswith("transformer.transformer_blocks."),
+        )
+
+# Compile the DiT backbone so each denoising step runs fused Triton kernels.
+# Default mode: no CUDA graphs, since CFG calls the transformer twice per step and a graph replay
+# would overwrite the first output while it is still in use; and no autotuning, which would hold
+# startup (and any recompile for a new input layout, mid-request) for minutes.
+# Shapes stay dynamic: target durations vary per request and padding them to a
+# bucket would change the speaking rate, as CFM spreads the text over the whole length.
+if COMPILE_DIT:
+    model.transformer = torch.compile(model.transformer, dynamic=True)
+
+def attention_backend():
+    """Restricts attention to the fused SDPA kernels when the DiT runs in half precision on CUDA."""
+    if model.device.type == "cuda" and next(model.parameters()).dtype in (torch.float16, torch.bfloat16):
+        # FlashAttention is preferred; memory-efficient attention covers masked batches and older GPUs.
+        # The math kernel stays allowed as a last resort, for inputs no fused kernel supports
+        return sdpa_kernel([SDPBackend.FLASH_ATTENTION, SDPBackend.EFFICIENT_ATTENTION, SDPBackend.MATH])
+    return nullcontext()
+
+# Upper bound on queued requests Gradio hands to infer_tts_batch in one call
+MAX_BATCH_SIZE = 4
+
+# Concurrent runs of the lightweight UI events (sample selection, refresh); they never touch the GPU,
+# and both synthesis events set their own limit through the "gpu" concurrency group
+UI_CONCURRENCY_LIMIT = 4
+
+_model_warmed_up = False
+_warmup_lock = threading.Lock()
+
+def warmup_model():
+    """
+    Runs short syntheses so DiT compilation and vocoder CUDA-graph capture happen
+    before real requests: a single-request synthesis, a two-request batch (batched, masked DiT
+    calls compile separately) and one vocoder pass per graph bucket, which covers stream windows.
+    Handlers call it before any GPU work of their own, since a CUDA graph capture fails if
+    another thread launches kernels meanwhile.
+    It runs once: if it fails, the DiT and the vocoder fall back to eager execution.
+    """
+    global _model_warmed_up
+    if ZERO_GPU:
+        return
+
+    with _warmup_lock:
+        if _model_warmed_up:
+            return
+        _model_warmed_up = True
+
+        # One second of low-level noise as reference (pure silence would divide by a zero RMS)
+        dummy_audio = torch.randn(1, 24000) * 0.01
+        try:
+            with attention_backend():
+                infer_batch_process((dummy_audio, 24000), "xin chào. ", ["xin chào"], model, vocoder, device=model.device)
+
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    dummy_path = os.path.join(tmp_dir, "warmup.wav")
+                    sf.write(dummy_path, dummy_audio[0].numpy(), 24000)
+                    # texts of different lengths, so the batch is padded and masked
+                    infer_multi_process(
+                        [dummy_path, dummy_path],
+                        ["xin chào. ", "xin chào. "],
+                        ["xin chào", "xin chào các bạn"],
+                        model,
+                        vocoder,
+                        device=model.device,
+                    )
+
+                with torch.inference_mode():
+                    for num_frames in range(vocoder.bucket_frames, vocoder.max_graph_frames + 1, vocoder.bucket_frames):
+                        vocoder.decode(torch.zeros(1, n_mel_channels, num_frames, device=model.device))
+        except Exception as e:
+            # the int8 weights stay quantized: the eager DiT is correct, just slower than unquantized
+            print(f"Warmup failed, running the DiT and the vocoder eagerly: {e}")
+            model.transformer = getattr(model.transformer, "_orig_mod", model.transformer)
+            vocoder.max_graph_frames = 0
+
+# Warm up in the background at startup so the first user does not pay for it
+if torch.cuda.is_available() and not ZERO_GPU:
+    threading.Thread(target=warmup_model, daemon=True).start()
+
+@functools.lru_cache(maxsize=32)
+def _cached_preprocess(ref_audio_orig: str, ref_text_input: str, mtime: float):
+    """Memoized preprocess_ref_audio_text; mtime is part of the key so an edited file is processed again."""
+    return preprocess_ref_audio_text(ref_audio_orig, ref_text_input)
+
+def preprocess_reference(ref_audio_orig: str, ref_text_input: str):
+    """
+    Pre-processes a reference audio and text, reusing the result for a repeated reference.
+    Users typically keep the same sample voice across many requests.
+    """
+    mtime = os.path.getmtime(ref_audio_orig)
+    ref_audio, ref_text = _cached_preprocess(ref_audio_orig, ref_text_input, mtime)
+
+    # The processed wav lives in the temp directory and may have been cleaned up since
+    if not os.path.exists(ref_audio):
+        _cached_preprocess.cache_clear()
+        ref_audio, ref_text = _cached_preprocess(ref_audio_orig, ref_text_input, mtime)
+    return ref_audio, ref_text
+
+def input_error(ref_audio_orig: str, gen_text: str):
+    """Returns a user-facing message if a request is missing its reference audio or has invalid text, else None."""
+    if not ref_audio_orig:
+        return "Please upload a sample audio file."
+    if not gen_text.strip():
+        return "Please enter the text content to generate voice."
+    # Splitting on any whitespace stops after 1001 pieces, however long the text is
+    if len(gen_text.split(maxsplit=1000)) > 1000:
+        return "Please enter text content with less than 1000 words."
+    return None
+
+def validate_inputs(ref_audio_orig: str, gen_text: str):
+    """Raises the input_error message of an invalid request as a gr.Error."""
+    error = input_error(ref_audio_orig, gen_text)
+    if error:
+        raise gr.Error(error)
+
 @spaces.GPU # Use ZeroGPU if available on Hugging Face Spaces
-def infer_tts(ref_audio_orig: str, ref_text_input: str, gen_text: str, speed: float = 1.0, request: gr.Request = None):
+def infer_tts(
+    ref_audio_orig: str,
+    ref_text_input: str,
+    gen_text: str,
+    speed: float = 1.0,
+    nfe_steps: int = 20,
+    return_spectrogram: bool = True,
+    request: gr.Request = None,
+):
     """
     Main inference function for TTS generation.
+    Streams audio chunks as soon as they are vocoded; the spectrogram arrives with the last chunk.
     
     Args:
         ref_audio_orig (str): Path to the reference audio file.
         ref_text_input (str): Optional manual transcription of the reference audio.
         gen_text (str): The target Vietnamese text to synthesize.
         speed (float): Playback speed multiplier (default 1.0).
+        nfe_steps (int): Number of ODE steps of the flow-matching sampler (default 20).
+        return_spectrogram (bool): Whether to render the spectrogram image (default True).
     """
 
     # Input validation
-    if not ref_audio_orig:
-        raise gr.Error("Please upload a sample audio file.")
-    if not gen_text.strip():
-        raise gr.Error("Please enter the text content to generate voice.")
-    if len(gen_text.split()) > 1000:
-        raise gr.Error("Please enter text content with less than 1000 words.")
+    validate_inputs(ref_audio_orig, gen_text)
     
     try:
+        # Start normalizing the target text with vinorm in the background
+        norm_future = _NORM_POOL.submit(normalize_text, gen_text)
+
+        # Wait for the startup warmup if it is still running, before touching the GPU
+        warmup_model()
+
         # Step 1: Pre-process reference audio and text (handles automatic transcription if ref_text_input is empty)
-        ref_audio, ref_text = preprocess_ref_audio_text(ref_audio_orig, ref_text_input)
+        ref_audio, ref_text = preprocess_reference(ref_audio_orig, ref_text_input)
         
-        # Step 2: Normalize the target text using vinorm and run the core inference process
-        # vinorm converts numbers and special characters to spoken Vietnamese
-        final_wave, final_sample_rate, spectrogram = infer_process(
-            ref_audio, 
-            ref_text.lower(), 
-            post_process(TTSnorm(gen_text)).lower(), 
-            model, 
-            vocoder, 
-            speed=speed
-        )
-        
-        # Step 3: Save the resulting spectrogram to a temporary file for display
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_spectrogram:
-            spectrogram_path = tmp_spectrogram.name
-            save_spectrogram(spectrogram, spectrogram_path)
+        # Step 2: Collect the normalized target text and run the core inference process
+        # (inference_mode is thread-local and Gradio may resume this generator on another thread,
+        # so infer_process_stream enables it per step rather than across the yields here)
+        with attention_backend():
+            for wave_chunk, sample_rate, spectrogram in infer_process_stream(
+                ref_audio, 
+                ref_text.lower(), 
+                norm_future.result(), 
+                model, 
+                vocoder, 
+                speed=speed,
+                nfe_step=int(nfe_steps),
+            ):
+                # Step 3: Render the final spectrogram in memory for display, if requested
+                spectrogram_image = None
+                if spectrogram is not None and return_spectrogram:
+                    spectrogram_image = spectrogram_to_image(spectrogram)
+
+                # Stream the audio chunk (and, at the end, the spectrogram image) to Gradio
+                yield (sample_rate, wave_chunk), spectrogram_image
+    
+    except Exception as e:
+        raise gr.Error(f"Error generating voice: {e}")
 
-        # Return audio data and spectrogram path to Gradio
-        return (final_sample_rate, final_wave), spectrogram_path
+@spaces.GPU # Use ZeroGPU if available on Hugging Face Spaces
+def infer_tts_batch(
+    ref_audios: list,
+    ref_text_inputs: list,
+    gen_texts: list,
+    speeds: list,
+    nfe_steps: list,
+    return_spectrograms: list,
+):
+    """
+    Batched variant of infer_tts behind the API-only "synthesize_batch" endpoint, used by Gradio's
+    dynamic batching (the UI streams through infer_tts, and streaming outputs cannot be batched).
+    Every argument holds one entry per queued request; text chunks from all of them
+    are denoised together, so concurrent API callers share each DiT forward pass.
     
+    Returns:
+        tuple: A list of (sample_rate, wave) and a list of spectrogram images (None if not requested),
+        one per request. Invalid requests get None for both, with their input_error message shown as
+        a gr.Warning, instead of failing the whole batch.
+    """
+
+    audios = [None] * len(gen_texts)
+    spectrogram_images = [None] * len(gen_texts)
+
+    # Input validation, per request; a rejected request is reported as a warning, so callers
+    # can tell it from a failed synthesis (which raises for the whole batch)
+    valid = []
+    for i, (ref_audio_orig, gen_text) in enumerate(zip(ref_audios, gen_texts)):
+        error = input_error(ref_audio_orig, gen_text)
+        if error:
+            gr.Warning(error)
+        else:
+            valid.append(i)
+    if not valid:
+        return audios, spectrogram_images
+
+    try:
+        # Start normalizing the target texts with vinorm in the background
+        norm_futures = [_NORM_POOL.submit(normalize_text, gen_texts[i]) for i in valid]
+
+        # Wait for the startup warmup if it is still running, before touching the GPU
+        warmup_model()
+
+        # Step 1: Pre-process every reference audio and text
+        refs = [preprocess_reference(ref_audios[i], ref_text_inputs[i]) for i in valid]
+
+        # Step 2: Collect the normalized target texts and run the batched inference process
+        with attention_backend(), torch.inference_mode():
+            results = infer_multi_process(
+                [ref_audio for ref_audio, _ in refs],
+                [ref_text.lower() for _, ref_text in refs],
+                [norm_future.result() for norm_future in norm_futures],
+                model,
+                vocoder,
+                speeds=[speeds[i] for i in valid],
+                nfe_steps=[int(nfe_steps[i]) for i in valid],
+                max_batch_size=MAX_BATCH_SIZE,
+            )
+
+        # Step 3: Render each requested spectrogram in memory for display
+        for i, (final_wave, final_sample_rate, spectrogram) in zip(valid, results):
+            audios[i] = (final_sample_rate, final_wave)
+            if return_spectrograms[i]:
+                spectrogram_images[i] = spectrogram_to_image(spectrogram)
+
+        return audios, spectrogram_images
+
     except Exception as e:
         raise gr.Error(f"Error generating voice: {e}")
 
@@ -310,14 +592,22 @@ with gr.Blocks() as demo:
             with gr.Group(elem_classes="custom-card"):
                 gr.Markdown("🎧 **3. Kết Quả (Generated Output)**")
                 with gr.Row():
-                    output_audio = gr.Audio(label="Bản âm thanh", type="numpy")
-                    output_spectrogram = gr.Image(label="Âm phổ (Spectrogram)")
+                    output_audio = gr.Audio(label="Bản âm thanh", type="numpy", streaming=True, autoplay=True)
+                    output_spectrogram = gr.Image(label="Âm phổ (Spectrogram)", type="pil")
+
+                # Hidden components backing the API-only "synthesize_batch" endpoint: the UI button streams
+                # through infer_tts, and streaming outputs cannot be batched, so nothing here is shown
+                btn_synthesize_batch = gr.Button(visible=False)
+                batch_output_audio = gr.Audio(type="numpy", visible=False)
+                batch_output_spectrogram = gr.Image(type="pil", visible=False)
 
         with gr.TabItem("⚙️ Advanced Settings"):
             with gr.Group(elem_classes="custom-card"):
-                gr.Markdown("### 🛠️ Cấu Hình Nâng Cao (Sắp ra mắt)")
+                gr.Markdown("### 🛠️ Cấu Hình Nâng Cao")
                 gr.Checkbox(label="Sử dụng ODE Integration (Euler)", value=True, interactive=False)
-                gr.Slider(label="NFE Steps", value=32, minimum=16, maximum=64, interactive=False)
+                # Fewer steps is proportionally faster; 16-20 is usually indistinguishable from 32
+                nfe_steps = gr.Slider(label="NFE Steps", value=20, minimum=16, maximum=64, step=1)
+                return_spectrogram = gr.Checkbox(label="Hiển thị âm phổ (Spectrogram)", value=True)
                 gr.Info("Lưu ý: Các thiết lập này hiện đang được tối ưu hóa tự động.")
 
         with gr.TabItem("📖 Guide & Docs"):
@@ -345,13 +635,28 @@ with gr.Blocks() as demo:
         outputs=[ref_audio, ref_text_input]
     )
 
+    # Both synthesis events share the GPU, so they run one at a time in the same concurrency group
     btn_synthesize.click(
         fn=infer_tts, 
-        inputs=[ref_audio, ref_text_input, gen_text, speed], 
-        outputs=[output_audio, output_spectrogram]
+        inputs=[ref_audio, ref_text_input, gen_text, speed, nfe_steps, return_spectrogram], 
+        outputs=[output_audio, output_spectrogram],
+        concurrency_limit=1,
+        concurrency_id="gpu",
+    )
+
+    # API only (/synthesize_batch): requests queued together are synthesized in one batched call
+    btn_synthesize_batch.click(
+        fn=infer_tts_batch, 
+        inputs=[ref_audio, ref_text_input, gen_text, speed, nfe_steps, return_spectrogram], 
+        outputs=[batch_output_audio, batch_output_spectrogram],
+        batch=True,
+        max_batch_size=MAX_BATCH_SIZE,
+        concurrency_limit=1,
+        concurrency_id="gpu",
+        api_name="synthesize_batch",
     )
 
 # Run the Gradio application
 # demo.queue() enables the request queue for handling multiple users
 if __name__ == "__main__":
-    demo.queue().launch(theme=gr.themes.Soft(), css=CUSTOM_CSS)
+    demo.queue(default_concurrency_limit=UI_CONCURRENCY_LIMIT).launch(theme=gr.themes.Soft(), css=CUSTOM_CSS)
@@ -20,6 +20,8 @@ import numpy as np
 import torch
 import torchaudio
 import tqdm
+from PIL import Image
+from torch.nn.utils.rnn import pad_sequence
 from huggingface_hub import snapshot_download, hf_hub_download
 from pydub import AudioSegment, silence
 from transformers import pipeline
@@ -27,6 +29,7 @@ from vocos import Vocos
 import soundfile as sf
 
 from f5_tts.model import CFM
+from f5_tts.model.modules import Attention, AttnProcessor
 from f5_tts.model.utils import (
     get_tokenizer,
     convert_char_to_pinyin,
@@ -60,6 +63,9 @@ cfg_strength = 2.0
 sway_sampling_coef = -1.0
 speed = 1.0
 fix_duration = None
+stream_chunk_frames = 100  # mel frames of audio emitted per vocoder call when streaming, ~1s
+stream_overlap_frames = 8  # frames shared by consecutive stream windows and cross-faded to smooth the seam
+stream_context_frames = 32  # extra mel frames decoded on each side of a window, beyond Vocos' ~27-frame receptive field
 
 # -----------------------------------------
 
@@ -164,6 +170,80 @@ def load_vocoder(vocoder_name="vocos", is_local=False, local_path="", device=dev
         vocoder = vocoder.eval().to(device)
     return vocoder
 
+class CUDAGraphVocos:
+    """
+    Drop-in replacement for a Vocos vocoder's decode() that cuts kernel-launch overhead on CUDA.
+    The ConvNeXt backbone runs in FP16 and is replayed from a CUDA graph captured once per
+    (batch size, mel length rounded up to bucket_frames); the ISTFT head stays in FP32.
+    Mels are zero-padded up to their bucket and trimmed back afterwards; the padded frames are
+    zeroed again before every convolution, which then sees the same zero padding as on the
+    unpadded mel, so graph replays match eager decoding.
+    Longer mels than max_graph_frames, and non-CUDA devices, run eagerly.
+    decode() must not be called concurrently: the graphs share static buffers and one memory pool.
+    """
+
+    def __init__(self, vocoder, bucket_frames=100, max_graph_frames=1000):
+        self.vocoder = vocoder
+        self.bucket_frames = bucket_frames
+        self.max_graph_frames = max_graph_frames
+        self.graphs = {}
+
+        self.use_graphs = next(vocoder.parameters()).device.type == "cuda"
+        if self.use_graphs:
+            self.vocoder.backbone.half()
+            # replays never overlap, so all graphs can share one memory pool instead of one each
+            self.graph_pool = torch.cuda.graph_pool_handle()
+
+    def _masked_backbone(self, mel, mask):
+        # VocosBackbone.forward with the padded frames masked out at the input of every ConvNeXt block
+        # (the only layers mixing frames besides the embedding conv, whose input padding is already zero)
+        backbone = self.vocoder.backbone
+        x = backbone.embed(mel)
+        x = backbone.norm(x.transpose(1, 2)).transpose(1, 2)
+        for conv_block in backbone.convnext:
+            x = conv_block(x * mask)
+        return backbone.final_layer_norm(x.transpose(1, 2))
+
+    def _capture(self, batch_size, n_mels, num_frames, device):
+        static_mel = torch.zeros((batch_size, n_mels, num_frames), dtype=torch.float16, device=device)
+        static_mask = torch.ones((1, 1, num_frames), dtype=torch.float16, device=device)
+
+        # warm up on a side stream before capturing, as required by torch.cuda.graph
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            self._masked_backbone(static_mel, static_mask)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph, pool=self.graph_pool):
+            static_features = self._masked_backbone(static_mel, static_mask)
+        return graph, static_mel, static_mask, static_features
+
+    def decode(self, mel):
+        num_frames = mel.shape[-1]
+        bucket = -(-num_frames // self.bucket_frames) * self.bucket_frames
+
+        if not self.use_graphs:
+            features = self.vocoder.backbone(mel)
+        elif bucket > self.max_graph_frames:
+            features = self.vocoder.backbone(mel.half())
+        else:
+            key = (mel.shape[0], bucket)
+            if key not in self.graphs:
+                self.graphs[key] = self._capture(mel.shape[0], mel.shape[1], bucket, mel.device)
+            graph, static_mel, static_mask, static_features = self.graphs[key]
+
+            static_mel[..., :num_frames].copy_(mel)
+            static_mel[..., num_frames:].zero_()
+            static_mask[..., :num_frames].fill_(1)
+            static_mask[..., num_frames:].zero_()
+            graph.replay()
+            features = static_features[:, :num_frames]  # backbone output is [b, n, d]
+
+        return self.vocoder.head(features.float())
+
+
 def load_audio(file_path):
     """
     Load audio file safely across platforms.
@@ -283,9 +363,11 @@ def load_model(
     ode_method=ode_method,
     use_ema=True,
     device=device,
+    dtype=None,
 ):
     """
     Constructs the DiT model with CFM wrapper and loads weights.
+    If dtype is None, FP16 is used on capable GPUs and FP32 otherwise.
     """
     if vocab_file == "":
         vocab_file = str(files("f5_tts").joinpath("infer/examples/vocab.txt"))
@@ -313,12 +395,24 @@ def load_model(
     ).to(device)
 
     # Some vocoders require float32 for spectral calculations
-    dtype = torch.float32 if mel_spec_type == "bigvgan" else None
+    if dtype is None and mel_spec_type == "bigvgan":
+        dtype = torch.float32
     model = load_checkpoint(model, ckpt_path, device, dtype=dtype, use_ema=use_ema)
 
     return model
 
 
+def fuse_qkv_projections(model):
+    """
+    Load-time rewrite for inference: packs the Q/K/V projections of every self-attention layer
+    into a single Linear, so each layer issues one larger GEMM instead of three.
+    """
+    for module in model.modules():
+        if isinstance(module, Attention) and isinstance(module.processor, AttnProcessor):
+            module.fuse_qkv_projections()
+    return model
+
+
 def remove_silence_edges(audio, silence_threshold=-42):
     """
     Trims silence from the beginning and end of an audio segment.
@@ -472,6 +566,66 @@ def infer_process(
 # infer batches
 
 
+def cross_fade_waves(generated_waves, cross_fade_duration=cross_fade_duration):
+    """
+    Joins consecutive generated segments, linearly cross-fading cross_fade_duration seconds at each seam.
+    """
+    if cross_fade_duration <= 0:
+        # Simply concatenate
+        final_wave = np.concatenate(generated_waves)
+    else:
+        final_wave = generated_waves[0]
+        for i in range(1, len(generated_waves)):
+            prev_wave = final_wave
+            next_wave = generated_waves[i]
+
+            # Calculate cross-fade samples, ensuring it does not exceed wave lengths
+            cross_fade_samples = int(cross_fade_duration * target_sample_rate)
+            cross_fade_samples = min(cross_fade_samples, len(prev_wave), len(next_wave))
+
+            if cross_fade_samples <= 0:
+                # No overlap possible, concatenate
+                final_wave = np.concatenate([prev_wave, next_wave])
+                continue
+
+            # Overlapping parts
+            prev_overlap = prev_wave[-cross_fade_samples:]
+            next_overlap = next_wave[:cross_fade_samples]
+
+            # Fade out and fade in
+            fade_out = np.linspace(1, 0, cross_fade_samples)
+            fade_in = np.linspace(0, 1, cross_fade_samples)
+
+            # Cross-faded overlap
+            cross_faded_overlap = prev_overlap * fade_out + next_overlap * fade_in
+
+            # Combine
+            new_wave = np.concatenate(
+                [prev_wave[:-cross_fade_samples], cross_faded_overlap, next_wave[cross_fade_samples:]]
+            )
+
+            final_wave = new_wave
+
+    return final_wave
+
+
+def prepare_ref_audio(audio, sr, target_rms=target_rms, device=device):
+    """
+    Downmixes the reference audio to mono, raises its loudness to target_rms and resamples it.
+    Returns the prepared audio and its original RMS, used to scale the generated audio back.
+    """
+    if audio.shape[0] > 1:
+        audio = torch.mean(audio, dim=0, keepdim=True)
+
+    rms = torch.sqrt(torch.mean(torch.square(audio)))
+    if rms < target_rms:
+        audio = audio * target_rms / rms
+    if sr != target_sample_rate:
+        resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
+        audio = resampler(audio)
+    return audio.to(device), rms
+
+
 def infer_batch_process(
     ref_audio,
     ref_text,
@@ -490,16 +644,7 @@ def infer_batch_process(
     device=None,
 ):
     audio, sr = ref_audio
-    if audio.shape[0] > 1:
-        audio = torch.mean(audio, dim=0, keepdim=True)
-
-    rms = torch.sqrt(torch.mean(torch.square(audio)))
-    if rms < target_rms:
-        audio = audio * target_rms / rms
-    if sr != target_sample_rate:
-        resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
-        audio = resampler(audio)
-    audio = audio.to(device)
+    audio, rms = prepare_ref_audio(audio, sr, target_rms=target_rms, device=device)
 
     generated_waves = []
     spectrograms = []
@@ -548,46 +693,224 @@ def infer_batch_process(
             spectrograms.append(generated_mel_spec[0].cpu().numpy())
 
     # Combine all generated waves with cross-fading
-    if cross_fade_duration <= 0:
-        # Simply concatenate
-        final_wave = np.concatenate(generated_waves)
-    else:
-        final_wave = generated_waves[0]
-        for i in range(1, len(generated_waves)):
-            prev_wave = final_wave
-            next_wave = generated_waves[i]
+    final_wave = cross_fade_waves(generated_waves, cross_fade_duration)
 
-            # Calculate cross-fade samples, ensuring it does not exceed wave lengths
-            cross_fade_samples = int(cross_fade_duration * target_sample_rate)
-            cross_fade_samples = min(cross_fade_samples, len(prev_wave), len(next_wave))
+    # Create a combined spectrogram
+    combined_spectrogram = np.concatenate(spectrograms, axis=1)
 
-            if cross_fade_samples <= 0:
-                # No overlap possible, concatenate
-                final_wave = np.concatenate([prev_wave, next_wave])
-                continue
+    return final_wave, target_sample_rate, combined_spectrogram
 
-            # Overlapping parts
-            prev_overlap = prev_wave[-cross_fade_samples:]
-            next_overlap = next_wave[:cross_fade_samples]
 
-            # Fade out and fade in
-            fade_out = np.linspace(1, 0, cross_fade_samples)
-            fade_in = np.linspace(0, 1, cross_fade_samples)
+# infer process, streaming: yield audio as soon as each piece of the mel is vocoded
 
-            # Cross-faded overlap
-            cross_faded_overlap = prev_overlap * fade_out + next_overlap * fade_in
 
-            # Combine
-            new_wave = np.concatenate(
-                [prev_wave[:-cross_fade_samples], cross_faded_overlap, next_wave[cross_fade_samples:]]
+def infer_process_stream(
+    ref_audio,
+    ref_text,
+    gen_text,
+    model_obj,
+    vocoder,
+    mel_spec_type=mel_spec_type,
+    show_info=print,
+    target_rms=target_rms,
+    cross_fade_duration=cross_fade_duration,
+    nfe_step=nfe_step,
+    cfg_strength=cfg_strength,
+    sway_sampling_coef=sway_sampling_coef,
+    speed=speed,
+    chunk_frames=stream_chunk_frames,
+    overlap_frames=stream_overlap_frames,
+    context_frames=stream_context_frames,
+    device=device,
+):
+    """
+    Streaming counterpart of infer_process, a generator of (wave_chunk, sample_rate, spectrogram):
+    1. Generates the mel of each text chunk in turn.
+    2. Vocodes it in windows of chunk_frames that overlap by overlap_frames, cross-fading the overlaps.
+       Each window is decoded with context_frames of mel on both sides and trimmed back, so its
+       samples match a single pass over the whole mel.
+    3. Yields audio as it is ready, holding back only the tail still needed for the next cross-fade.
+    spectrogram is None except on the last item, where it holds the combined spectrogram.
+    """
+    audio, sr = load_audio(ref_audio)
+    max_chars = int(len(ref_text.encode("utf-8")) / (audio.shape[-1] / sr) * (25 - audio.shape[-1] / sr))
+    gen_text_batches = chunk_text(gen_text, max_chars=max_chars)
+    show_info(f"Streaming audio in {len(gen_text_batches)} batches...")
+
+    audio, rms = prepare_ref_audio(audio, sr, target_rms=target_rms, device=device)
+    if len(ref_text[-1].encode("utf-8")) == 1:
+        ref_text = ref_text + " "
+
+    ref_audio_len = audio.shape[-1] // hop_length
+    ref_text_len = len(ref_text.encode("utf-8"))
+    batch_cross_fade = int(cross_fade_duration * target_sample_rate)
+    hold_samples = max(overlap_frames * hop_length, batch_cross_fade)
+
+    pending = np.zeros(0, dtype=np.float32)
+    spectrograms = []
+    for gen_text in gen_text_batches:
+        final_text_list = convert_char_to_pinyin([ref_text + gen_text])
+        duration = ref_audio_len + int(ref_audio_len / ref_text_len * len(gen_text.encode("utf-8")) / speed)
+
+        # inference
+        with torch.inference_mode():
+            generated, _ = model_obj.sample(
+                cond=audio,
+                text=final_text_list,
+                duration=duration,
+                steps=nfe_step,
+                cfg_strength=cfg_strength,
+                sway_sampling_coef=sway_sampling_coef,
             )
+            generated = generated.to(torch.float32)
+            generated_mel_spec = generated[:, ref_audio_len:, :].permute(0, 2, 1)
+        spectrograms.append(generated_mel_spec[0].cpu().numpy())
+
+        # Vocode overlapping windows; a window is cross-faded with the previous one over their shared
+        # samples, and a new text batch with the previous batch like cross_fade_waves does
+        num_frames = generated_mel_spec.shape[-1]
+        window_step = chunk_frames - overlap_frames
+        for start in range(0, max(num_frames - overlap_frames, 1), window_step):
+            end = min(start + chunk_frames, num_frames)
+            context_start = max(start - context_frames, 0)
+            context_end = min(end + context_frames, num_frames)
+            with torch.inference_mode():
+                mel_window = generated_mel_spec[:, :, context_start:context_end]
+                if mel_spec_type == "vocos":
+                    wave = vocoder.decode(mel_window)
+                elif mel_spec_type == "bigvgan":
+                    wave = vocoder(mel_window)
+                if rms < target_rms:
+                    wave = wave * rms / target_rms
+                wave = wave.squeeze().cpu().numpy()
+
+            # trim the context back to the window's own frames; the last window keeps the tail
+            # the vocoder adds past its final frame, like a single pass over the mel would
+            wave_start = (start - context_start) * hop_length
+            wave = wave[wave_start : wave_start + (end - start) * hop_length] if end < num_frames else wave[wave_start:]
+
+            # consecutive windows share overlap_frames, cross-faded only to smooth the seam
+            fade_samples = batch_cross_fade if start == 0 else overlap_frames * hop_length
+            fade_samples = min(fade_samples, len(pending), len(wave))
+            if fade_samples > 0:
+                fade_out = np.linspace(1, 0, fade_samples)
+                fade_in = np.linspace(0, 1, fade_samples)
+                overlap = pending[-fade_samples:] * fade_out + wave[:fade_samples] * fade_in
+                pending = np.concatenate([pending[:-fade_samples], overlap, wave[fade_samples:]])
+            else:
+                pending = np.concatenate([pending, wave])
 
-            final_wave = new_wave
+            if len(pending) > hold_samples:
+                yield pending[:-hold_samples], target_sample_rate, None
+                pending = pending[-hold_samples:]
 
-    # Create a combined spectrogram
-    combined_spectrogram = np.concatenate(spectrograms, axis=1)
+    yield pending, target_sample_rate, np.concatenate(spectrograms, axis=1)
 
-    return final_wave, target_sample_rate, combined_spectrogram
+
+# infer several requests at once: chunk each text, then sample chunks of different requests together
+
+
+def infer_multi_process(
+    ref_audios,
+    ref_texts,
+    gen_texts,
+    model_obj,
+    vocoder,
+    mel_spec_type=mel_spec_type,
+    show_info=print,
+    target_rms=target_rms,
+    cross_fade_duration=cross_fade_duration,
+    nfe_step=nfe_step,
+    cfg_strength=cfg_strength,
+    sway_sampling_coef=sway_sampling_coef,
+    speeds=None,
+    nfe_steps=None,
+    max_batch_size=4,
+    device=device,
+):
+    """
+    Batched counterpart of infer_process for independent requests:
+    1. Loads each reference audio and chunks each text like infer_process.
+    2. Samples up to max_batch_size chunks sharing an NFE step count, from any request, in one padded and masked call.
+    3. Merges the generated segments of each request with cross-fading.
+    Returns a list of (final_wave, sample_rate, combined_spectrogram), one per request.
+    """
+    if speeds is None:
+        speeds = [speed] * len(gen_texts)
+    if nfe_steps is None:
+        nfe_steps = [nfe_step] * len(gen_texts)
+
+    # Flatten all requests into (request index, ref audio, ref rms, ref text, gen text, speed, nfe step) jobs
+    jobs = []
+    for i, (ref_audio, ref_text, gen_text, job_speed, job_nfe_step) in enumerate(
+        zip(ref_audios, ref_texts, gen_texts, speeds, nfe_steps)
+    ):
+        audio, sr = load_audio(ref_audio)
+        max_chars = int(len(ref_text.encode("utf-8")) / (audio.shape[-1] / sr) * (25 - audio.shape[-1] / sr))
+        audio, rms = prepare_ref_audio(audio, sr, target_rms=target_rms, device=device)
+        if len(ref_text[-1].encode("utf-8")) == 1:
+            ref_text = ref_text + " "
+        for gen_text_batch in chunk_text(gen_text, max_chars=max_chars):
+            jobs.append((i, audio, rms, ref_text, gen_text_batch, job_speed, job_nfe_step))
+
+    show_info(f"Generating audio for {len(gen_texts)} requests in {len(jobs)} chunks...")
+    generated_waves = [[] for _ in gen_texts]
+    spectrograms = [[] for _ in gen_texts]
+
+    # A sampling call runs a single step count, so batch only jobs that share one
+    batches = []
+    for batch_nfe_step in sorted(set(job[-1] for job in jobs)):
+        step_jobs = [job for job in jobs if job[-1] == batch_nfe_step]
+        for start in range(0, len(step_jobs), max_batch_size):
+            batches.append((batch_nfe_step, step_jobs[start : start + max_batch_size]))
+
+    for batch_nfe_step, batch_jobs in batches:
+        final_text_list = convert_char_to_pinyin([ref_text + gen_text for _, _, _, ref_text, gen_text, *_ in batch_jobs])
+
+        ref_audio_lens = []
+        durations = []
+        for (_, audio, _, ref_text, gen_text, job_speed, _), text in zip(batch_jobs, final_text_list):
+            ref_audio_len = audio.shape[-1] // hop_length
+            ref_text_len = len(ref_text.encode("utf-8"))
+            gen_text_len = len(gen_text.encode("utf-8"))
+            duration = ref_audio_len + int(ref_audio_len / ref_text_len * gen_text_len / job_speed)
+            # same lower bound CFM.sample applies, so each output can be cut at its own length
+            duration = min(max(duration, len(text) + 1, ref_audio_len + 1), 4096)
+            ref_audio_lens.append(ref_audio_len)
+            durations.append(duration)
+
+        # Pad reference waves to a common length; lens masks the padding out of the conditioning
+        cond = pad_sequence([audio.squeeze(0) for _, audio, *_ in batch_jobs], batch_first=True)
+
+        # inference
+        with torch.inference_mode():
+            generated, _ = model_obj.sample(
+                cond=cond,
+                text=final_text_list,
+                duration=torch.tensor(durations, dtype=torch.long, device=cond.device),
+                lens=torch.tensor(ref_audio_lens, dtype=torch.long, device=cond.device),
+                steps=batch_nfe_step,
+                cfg_strength=cfg_strength,
+                sway_sampling_coef=sway_sampling_coef,
+            )
+            generated = generated.to(torch.float32)
+
+            for j, (i, _, rms, *_) in enumerate(batch_jobs):
+                generated_mel_spec = generated[j : j + 1, ref_audio_lens[j] : durations[j], :].permute(0, 2, 1)
+                if mel_spec_type == "vocos":
+                    generated_wave = vocoder.decode(generated_mel_spec)
+                elif mel_spec_type == "bigvgan":
+                    generated_wave = vocoder(generated_mel_spec)
+                if rms < target_rms:
+                    generated_wave = generated_wave * rms / target_rms
+
+                generated_waves[i].append(generated_wave.squeeze().cpu().numpy())
+                spectrograms[i].append(generated_mel_spec[0].cpu().numpy())
+
+    return [
+        (cross_fade_waves(waves, cross_fade_duration), target_sample_rate, np.concatenate(spects, axis=1))
+        for waves, spects in zip(generated_waves, spectrograms)
+    ]
 
 
 # remove silence from generated wav
@@ -614,3 +937,20 @@ def save_spectrogram(spectrogram, path):
     plt.colorbar()
     plt.savefig(path)
     plt.close()
+
+
+# viridis as a [256, 3] uint8 lookup table, the colormap save_spectrogram gets from imshow
+spectrogram_colormap = torch.from_numpy(np.round(matplotlib.colormaps["viridis"](np.arange(256))[:, :3] * 255)).to(torch.uint8)
+
+
+def spectrogram_to_image(spectrogram):
+    """
+    Renders a [n_mels, frames] spectrogram as a viridis RGB image without matplotlib's figure rendering:
+    min-max normalized and mapped through a colormap lookup table with tensor ops on the spectrogram's
+    device, low frequencies at the bottom. Only the final uint8 image is moved to the CPU.
+    """
+    spectrogram = torch.as_tensor(spectrogram)
+    spectrogram = (spectrogram - spectrogram.min()) / (spectrogram.max() - spectrogram.min() + 1e-8)
+    indices = (spectrogram.flip(0) * 255).long()
+    image = spectrogram_colormap.to(indices.device)[indices]  # [n_mels, frames, 3]
+    return Image.fromarray(image.cpu().numpy())
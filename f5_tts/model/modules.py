@@ -361,6 +361,7 @@ class Attention(nn.Module):
         self.to_q = nn.Linear(dim, self.inner_dim)
         self.to_k = nn.Linear(dim, self.inner_dim)
         self.to_v = nn.Linear(dim, self.inner_dim)
+        self.to_qkv = None  # set by fuse_qkv_projections()
 
         if self.context_dim is not None:
             self.to_k_c = nn.Linear(context_dim, self.inner_dim)
@@ -375,6 +376,20 @@ class Attention(nn.Module):
         if self.context_pre_only is not None and not self.context_pre_only:
             self.to_out_c = nn.Linear(self.inner_dim, dim)
 
+    # inference only: pack to_q, to_k, to_v into one Linear so x is projected by a single GEMM
+    # only AttnProcessor reads the fused projection, joint attention keeps the separate ones
+    @torch.no_grad()
+    def fuse_qkv_projections(self):
+        if self.to_qkv is not None:
+            return
+
+        weight = torch.cat([self.to_q.weight, self.to_k.weight, self.to_v.weight], dim=0)
+        bias = torch.cat([self.to_q.bias, self.to_k.bias, self.to_v.bias], dim=0)
+        self.to_qkv = nn.Linear(self.dim, 3 * self.inner_dim, device=weight.device, dtype=weight.dtype)
+        self.to_qkv.weight.copy_(weight)
+        self.to_qkv.bias.copy_(bias)
+        del self.to_q, self.to_k, self.to_v
+
     def forward(
         self,
         x: float["b n d"],  # noised input x  # noqa: F722
@@ -406,9 +421,12 @@ class AttnProcessor:
         batch_size = x.shape[0]
 
         # `sample` projections.
-        query = attn.to_q(x)
-        key = attn.to_k(x)
-        value = attn.to_v(x)
+        if attn.to_qkv is not None:
+            query, key, value = attn.to_qkv(x).chunk(3, dim=-1)
+        else:
+            query = attn.to_q(x)
+            key = attn.to_k(x)
+            value = attn.to_v(x)
 
         # apply rotary position embedding
         if rope is not None: